@@ -1,9 +1,38 @@
-from typing import Optional, Set
+from base64 import urlsafe_b64decode
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional, Set, Tuple
+import hashlib
+import logging
 import os
+import threading
+import time
+import binascii
+import orjson
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
 from fastapi import FastAPI, Request, HTTPException, status
 from fastapi.responses import PlainTextResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from jwt import decode as jwt_decode, InvalidTokenError, PyJWKClient
+from starlette.concurrency import run_in_threadpool
+from jwt import (
+    DecodeError,
+    ExpiredSignatureError,
+    ImmatureSignatureError,
+    InvalidAlgorithmError,
+    InvalidAudienceError,
+    InvalidIssuedAtError,
+    InvalidIssuerError,
+    InvalidSignatureError,
+    InvalidTokenError,
+    MissingRequiredClaimError,
+    PyJWKClient,
+    PyJWKClientError,
+)
+
+logger = logging.getLogger(__name__)
 
 # ------------------------------------------------------------------------------
 # Configuration (set via env or hardcode for testing)
@@ -15,44 +44,187 @@ CLIENT_ID = os.getenv("KEYCLOAK_CLIENT_ID", "my-client-id")
 ISSUER = f"{KEYCLOAK_BASE_URL}/realms/{KEYCLOAK_REALM}"
 JWKS_URL = f"{ISSUER}/protocol/openid-connect/certs"
 
+# Verified-claims cache: repeated bearer tokens skip the RS256 verification
+CLAIMS_CACHE_MAXSIZE = int(os.getenv("CLAIMS_CACHE_MAXSIZE", "10000"))
+CLAIMS_CACHE_TTL = float(os.getenv("CLAIMS_CACHE_TTL", "60"))
+
 # ------------------------------------------------------------------------------
 # App & JWKS client
 # ------------------------------------------------------------------------------
-app = FastAPI(title="Keycloak JWT + RBAC Demo")
-jwk_client = PyJWKClient(JWKS_URL)
+# Created once; signing keys are cached per kid and the JWK set for an hour
+jwk_client = PyJWKClient(JWKS_URL, cache_keys=True, max_cached_keys=32, lifespan=3600)
+
+def prime_jwks_cache() -> None:
+    """Fetches the JWKS once and fills the per-kid signing key cache."""
+    for signing_key in jwk_client.get_signing_keys():
+        jwk_client.get_signing_key(signing_key.key_id)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.jwk_client = jwk_client
+    try:
+        await run_in_threadpool(prime_jwks_cache)
+    except PyJWKClientError:
+        # Keycloak unreachable at startup: keys are fetched lazily instead
+        logger.warning("Could not pre-fetch JWKS from %s", JWKS_URL, exc_info=True)
+    yield
+
+app = FastAPI(title="Keycloak JWT + RBAC Demo", lifespan=lifespan)
 
 # ------------------------------------------------------------------------------
 # Helpers
 # ------------------------------------------------------------------------------
-def extract_bearer_token(authorization_header: Optional[str]) -> Optional[str]:
-    """Extracts 'Bearer <token>' from the Authorization header."""
+def get_authorization_header(headers) -> Optional[bytes]:
+    """Returns the raw Authorization header from ASGI scope headers."""
+    for name, value in headers:
+        if name == b"authorization":
+            return value
+    return None
+
+def extract_bearer_token(authorization_header: Optional[bytes]) -> Optional[bytes]:
+    """Extracts 'Bearer <token>' from the raw Authorization header."""
     if not authorization_header:
         return None
-    parts = authorization_header.split()
-    if len(parts) == 2 and parts[0].lower() == "bearer":
-        return parts[1]
+    if authorization_header.startswith(b"Bearer ") or authorization_header.startswith(b"bearer "):
+        return authorization_header[7:] or None
     return None
 
-def verify_keycloak_jwt(token: str) -> dict:
+# Maps blake2b(token) -> (expires_at, claims). Digests are stored instead of
+# the raw tokens so the cache never retains usable credentials.
+_claims_cache: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+_claims_cache_lock = threading.Lock()
+
+def _token_cache_key(token: bytes) -> bytes:
+    return hashlib.blake2b(token, digest_size=16).digest()
+
+def _get_cached_claims(key: bytes) -> Optional[dict]:
+    with _claims_cache_lock:
+        entry = _claims_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, claims = entry
+        if expires_at <= time.time():
+            del _claims_cache[key]
+            return None
+        _claims_cache.move_to_end(key)
+        return claims
+
+def _store_cached_claims(key: bytes, claims: dict) -> None:
+    # Never keep an entry past the token's own expiry
+    expires_at = min(float(claims["exp"]), time.time() + CLAIMS_CACHE_TTL)
+    with _claims_cache_lock:
+        _claims_cache[key] = (expires_at, claims)
+        _claims_cache.move_to_end(key)
+        while len(_claims_cache) > CLAIMS_CACHE_MAXSIZE:
+            _claims_cache.popitem(last=False)
+
+def verify_keycloak_jwt(token: bytes) -> dict:
+    """
+    Verifies the JWT (cached per token until min(exp, now + CLAIMS_CACHE_TTL)).
+    """
+    key = _token_cache_key(token)
+    claims = _get_cached_claims(key)
+    if claims is not None:
+        return claims
+    # Entries never outlive exp (see _store_cached_claims) and expired ones
+    # are dropped on read, so a failed verification has nothing to evict
+    claims = _verify_keycloak_jwt_uncached(token)
+    _store_cached_claims(key, claims)
+    return claims
+
+def _b64url_decode(segment: bytes) -> bytes:
+    try:
+        return urlsafe_b64decode(segment + b"=" * (-len(segment) % 4))
+    except (binascii.Error, ValueError) as e:
+        raise DecodeError("Invalid base64 segment") from e
+
+def _parse_json_segment(segment: bytes) -> dict:
+    try:
+        value = orjson.loads(_b64url_decode(segment))
+    except orjson.JSONDecodeError as e:
+        raise DecodeError("Invalid JSON segment") from e
+    if not isinstance(value, dict):
+        raise DecodeError("JSON segment must be an object")
+    return value
+
+def _verify_keycloak_jwt_uncached(token: bytes) -> dict:
     """
     Verifies the JWT against Keycloak JWKS:
     - Signature (RS256)
-    - Exp (expiration)
+    - Exp (expiration), iat/nbf (not in the future)
     - Issuer
     - Audience (client id)
     Returns decoded claims if valid; raises InvalidTokenError otherwise.
+
+    The RS256 signature is checked directly with the cached `cryptography`
+    public key (no PyJWT decode round-trip); claims are parsed with orjson.
     """
-    signing_key = jwk_client.get_signing_key_from_jwt(token).key
-    claims = jwt_decode(
-        token,
-        signing_key,
-        algorithms=["RS256"],
-        audience=CLIENT_ID,   # validate aud
-        issuer=ISSUER,        # validate iss
-        options={"require": ["exp", "iat", "iss", "aud"]},
-    )
+    parts = token.split(b".")
+    if len(parts) != 3:
+        raise DecodeError("Not enough segments")
+    header_b64, payload_b64, sig_b64 = parts
+
+    header = _parse_json_segment(header_b64)
+    if header.get("alg") != "RS256":
+        raise InvalidAlgorithmError("The specified alg value is not allowed")
+    kid = header.get("kid")
+    if not isinstance(kid, str) or not kid:
+        raise DecodeError("Key ID header parameter must be a non-empty string")
+    try:
+        signing_key = jwk_client.get_signing_key(kid).key
+    except PyJWKClientError as e:
+        # Unknown kid (or JWKS unreachable): reject rather than surface a 500
+        raise InvalidSignatureError("Unable to find a signing key for kid") from e
+    if not isinstance(signing_key, RSAPublicKey):
+        raise InvalidSignatureError("Signing key is not an RSA public key")
+
+    try:
+        signing_key.verify(
+            _b64url_decode(sig_b64),
+            header_b64 + b"." + payload_b64,
+            padding.PKCS1v15(),
+            hashes.SHA256(),
+        )
+    except InvalidSignature as e:
+        raise InvalidSignatureError("Signature verification failed") from e
+
+    claims = _parse_json_segment(payload_b64)
+    for claim in ("exp", "iat", "iss", "aud"):
+        if claim not in claims:
+            raise MissingRequiredClaimError(claim)
+
+    now = time.time()
+    try:
+        try:
+            iat = int(claims["iat"])
+        except (TypeError, ValueError) as e:
+            raise InvalidIssuedAtError("Issued At claim (iat) must be an integer.") from e
+        if iat > now:
+            raise ImmatureSignatureError("The token is not yet valid (iat)")
+        if float(claims["exp"]) <= now:
+            raise ExpiredSignatureError("Signature has expired")
+        if "nbf" in claims and float(claims["nbf"]) > now:
+            raise ImmatureSignatureError("The token is not yet valid (nbf)")
+    except (TypeError, ValueError) as e:
+        raise DecodeError("exp/nbf must be numeric") from e
+
+    if claims["iss"] != ISSUER:   # validate iss
+        raise InvalidIssuerError("Invalid issuer")
+    aud = claims["aud"]           # validate aud
+    if not (aud == CLIENT_ID or (isinstance(aud, list) and CLIENT_ID in aud)):
+        raise InvalidAudienceError("Audience doesn't match")
     return claims
 
+# Claims of the token verified by AdminRoleMiddleware for the current request
+token_claims_ctx: ContextVar[Optional[dict]] = ContextVar("token_claims", default=None)
+
+async def get_token_claims() -> Optional[dict]:
+    """Dependency: claims set by AdminRoleMiddleware (None on unprotected paths).
+
+    async so FastAPI calls it inline rather than via the threadpool.
+    """
+    return token_claims_ctx.get()
+
 def has_admin_role(claims: dict) -> bool:
     """
     Checks Keycloak realm role 'admin' in realm_access.roles.
@@ -67,42 +239,63 @@ def has_admin_role(claims: dict) -> bool:
 # ------------------------------------------------------------------------------
 # Middleware for RBAC enforcement on selected paths
 # ------------------------------------------------------------------------------
-class AdminRoleMiddleware(BaseHTTPMiddleware):
+class AdminRoleMiddleware:
     """
     Enforces that requests to the protected paths include a valid JWT with the
     'admin' role in realm_access.roles.
+
+    Pure ASGI middleware: unlike BaseHTTPMiddleware it adds no task group,
+    stream or Request object per request.
     """
     def __init__(self, app, protected_paths: Set[str]):
-        super().__init__(app)
-        self.protected_paths = protected_paths
-
-    async def dispatch(self, request: Request, call_next):
-        if request.url.path in self.protected_paths:
-            # 1) Extract token
-            token = extract_bearer_token(request.headers.get("Authorization"))
-            if not token:
-                return PlainTextResponse(
-                    "Forbidden: missing bearer token", status_code=status.HTTP_403_FORBIDDEN
-                )
-
-            # 2) Verify token
-            try:
-                claims = verify_keycloak_jwt(token)
-            except InvalidTokenError:
-                return PlainTextResponse(
-                    "Forbidden: invalid token", status_code=status.HTTP_403_FORBIDDEN
-                )
-
-            # 3) Check admin role
-            if not has_admin_role(claims):
-                return PlainTextResponse(
-                    "Forbidden: admin role required", status_code=status.HTTP_403_FORBIDDEN
-                )
-
-            # Optionally expose claims to downstream handlers
-            request.state.token_claims = claims
-
-        return await call_next(request)
+        self.app = app
+        self.protected_paths = frozenset(protected_paths)
+
+    async def __call__(self, scope, receive, send):
+        # Hot path: unprotected requests pass straight through before any
+        # header access. Match on the decoded scope["path"] (what the router
+        # uses), not raw_path: a percent-encoded variant such as
+        # /rbac%2Dsecure would otherwise skip the check but still be routed.
+        if scope["type"] != "http" or scope["path"] not in self.protected_paths:
+            await self.app(scope, receive, send)
+            return
+
+        # 1) Extract token
+        token = extract_bearer_token(get_authorization_header(scope["headers"]))
+        if not token:
+            await _send_forbidden(send, b"Forbidden: missing bearer token")
+            return
+
+        # 2) Verify token
+        try:
+            claims = verify_keycloak_jwt(token)
+        except InvalidTokenError:
+            await _send_forbidden(send, b"Forbidden: invalid token")
+            return
+
+        # 3) Check admin role
+        if not has_admin_role(claims):
+            await _send_forbidden(send, b"Forbidden: admin role required")
+            return
+
+        # Expose claims to downstream handlers via Depends(get_token_claims)
+        ctx_token = token_claims_ctx.set(claims)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            token_claims_ctx.reset(ctx_token)
+
+async def _send_forbidden(send, body: bytes) -> None:
+    """Sends a 403 text/plain response directly over ASGI."""
+    await send({
+        "type": "http.response.start",
+        "status": status.HTTP_403_FORBIDDEN,
+        "headers": [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
 
 # Protect exactly this endpoint with admin-only middleware
 app.add_middleware(AdminRoleMiddleware, protected_paths={"/rbac-secure"})
@@ -116,7 +309,7 @@ async def validate_endpoint(request: Request):
     """
     Returns "Access Granted" if the Keycloak JWT is valid, else "Access Denied".
     """
-    token = extract_bearer_token(request.headers.get("Authorization"))
+    token = extract_bearer_token(get_authorization_header(request.scope["headers"]))
     if not token:
         return PlainTextResponse("Access Denied", status_code=status.HTTP_401_UNAUTHORIZED)
 
@@ -140,6 +333,18 @@ async def ping():
     return PlainTextResponse("pong")
 
 # ------------------------------------------------------------------------------
-# Run (dev): uvicorn main:app --reload
+# Run (dev):  uvicorn main:app --reload
+# Run (prod): uvicorn main:app --loop uvloop --http httptools --workers $(nproc)
+#             or: python main.py  (pip install uvloop httptools)
 # ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    import uvicorn
 
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+    )
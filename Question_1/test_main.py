@@ -0,0 +1,236 @@
+import json
+import time
+from base64 import urlsafe_b64encode
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from fastapi.testclient import TestClient
+
+import main
+from main import extract_bearer_token, verify_keycloak_jwt
+
+RSA_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+KID = "test-kid"
+
+
+class FakeSigningKey:
+    def __init__(self, key):
+        self.key = key
+        self.key_id = KID
+
+
+class FakeJWKClient:
+    """Stands in for PyJWKClient: one known kid, counts lookups."""
+
+    def __init__(self, public_key):
+        self.public_key = public_key
+        self.calls = 0
+
+    def get_signing_key(self, kid):
+        self.calls += 1
+        if kid != KID:
+            raise main.PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return FakeSigningKey(self.public_key)
+
+
+@pytest.fixture(autouse=True)
+def fake_jwks(monkeypatch):
+    client = FakeJWKClient(RSA_KEY.public_key())
+    monkeypatch.setattr(main, "jwk_client", client)
+    main._claims_cache.clear()
+    yield client
+    main._claims_cache.clear()
+
+
+def make_token(roles=(), headers=None, **overrides) -> bytes:
+    now = int(time.time())
+    payload = {
+        "exp": now + 300,
+        "iat": now,
+        "iss": main.ISSUER,
+        "aud": main.CLIENT_ID,
+        "realm_access": {"roles": list(roles)},
+    }
+    payload.update(overrides)
+    return jwt.encode(
+        payload, RSA_KEY, algorithm="RS256", headers={"kid": KID, **(headers or {})}
+    ).encode()
+
+
+def b64url(data: dict) -> bytes:
+    return urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=")
+
+
+def test_extract_bearer_token_capitalized_prefix():
+    assert extract_bearer_token(b"Bearer abc.def.ghi") == b"abc.def.ghi"
+
+
+def test_extract_bearer_token_lowercase_prefix():
+    assert extract_bearer_token(b"bearer abc.def.ghi") == b"abc.def.ghi"
+
+
+def test_extract_bearer_token_empty_token():
+    assert extract_bearer_token(b"Bearer ") is None
+
+
+def test_extract_bearer_token_missing_header():
+    assert extract_bearer_token(None) is None
+    assert extract_bearer_token(b"") is None
+
+
+def test_extract_bearer_token_other_scheme():
+    assert extract_bearer_token(b"Basic dXNlcjpwYXNz") is None
+
+
+def test_extract_bearer_token_uppercase_prefix_rejected():
+    # Only the exact "Bearer " / "bearer " prefixes are matched
+    assert extract_bearer_token(b"BEARER abc.def.ghi") is None
+
+
+# ---------- verify_keycloak_jwt ----------
+
+def test_verify_valid_token():
+    claims = verify_keycloak_jwt(make_token(roles=["admin"]))
+    assert claims["iss"] == main.ISSUER
+    assert claims["realm_access"]["roles"] == ["admin"]
+
+
+def test_verify_audience_list():
+    assert verify_keycloak_jwt(make_token(aud=["other", main.CLIENT_ID]))
+    with pytest.raises(main.InvalidAudienceError):
+        verify_keycloak_jwt(make_token(aud=["other"]))
+
+
+def test_verify_tampered_signature():
+    header, payload, sig = make_token().split(b".")
+    mid = len(sig) // 2
+    sig = sig[:mid] + (b"A" if sig[mid:mid + 1] != b"A" else b"B") + sig[mid + 1:]
+    with pytest.raises(main.InvalidSignatureError):
+        verify_keycloak_jwt(b".".join([header, payload, sig]))
+
+
+def test_verify_tampered_payload():
+    header, _, sig = make_token().split(b".")
+    forged = b64url({"exp": time.time() + 300, "iat": time.time(), "iss": main.ISSUER,
+                     "aud": main.CLIENT_ID, "realm_access": {"roles": ["admin"]}})
+    with pytest.raises(main.InvalidSignatureError):
+        verify_keycloak_jwt(b".".join([header, forged, sig]))
+
+
+def test_verify_rejects_other_alg():
+    header = b64url({"alg": "HS256", "kid": KID})
+    _, payload, sig = make_token().split(b".")
+    with pytest.raises(main.InvalidAlgorithmError):
+        verify_keycloak_jwt(b".".join([header, payload, sig]))
+
+
+@pytest.mark.parametrize("overrides, error", [
+    ({"exp": int(time.time()) - 10}, main.ExpiredSignatureError),
+    ({"iat": int(time.time()) + 10000}, main.ImmatureSignatureError),
+    ({"iat": "soon"}, main.InvalidIssuedAtError),
+    ({"nbf": int(time.time()) + 10000}, main.ImmatureSignatureError),
+    ({"iss": "https://evil.example.com/realms/x"}, main.InvalidIssuerError),
+    ({"aud": "other-client"}, main.InvalidAudienceError),
+])
+def test_verify_rejects_bad_claims(overrides, error):
+    with pytest.raises(error):
+        verify_keycloak_jwt(make_token(**overrides))
+
+
+def test_verify_missing_required_claim():
+    token = jwt.encode({"iss": main.ISSUER, "aud": main.CLIENT_ID, "iat": int(time.time())},
+                       RSA_KEY, algorithm="RS256", headers={"kid": KID}).encode()
+    with pytest.raises(main.MissingRequiredClaimError):
+        verify_keycloak_jwt(token)
+
+
+def test_verify_unknown_kid():
+    with pytest.raises(main.InvalidSignatureError):
+        verify_keycloak_jwt(make_token(headers={"kid": "unknown"}))
+
+
+@pytest.mark.parametrize("kid", [["a"], 123, "", None])
+def test_verify_non_string_kid_rejected_before_lookup(fake_jwks, kid):
+    header = b64url({"alg": "RS256", "kid": kid})
+    _, payload, sig = make_token().split(b".")
+    with pytest.raises(main.DecodeError):
+        verify_keycloak_jwt(b".".join([header, payload, sig]))
+    assert fake_jwks.calls == 0
+
+
+def test_verify_non_rsa_key_rejected(fake_jwks):
+    fake_jwks.public_key = ec.generate_private_key(ec.SECP256R1()).public_key()
+    with pytest.raises(main.InvalidSignatureError):
+        verify_keycloak_jwt(make_token())
+
+
+def test_verify_malformed_token():
+    with pytest.raises(main.DecodeError):
+        verify_keycloak_jwt(b"not-a-jwt")
+
+
+# ---------- claims cache ----------
+
+def test_claims_cache_ttl_clamped_to_exp():
+    now = time.time()
+    main._store_cached_claims(b"short", {"exp": now + 5})
+    main._store_cached_claims(b"long", {"exp": now + 10_000})
+    assert main._claims_cache[b"short"][0] == pytest.approx(now + 5)
+    assert main._claims_cache[b"long"][0] == pytest.approx(now + main.CLAIMS_CACHE_TTL, abs=1)
+
+
+def test_claims_cache_drops_expired_entries(monkeypatch):
+    now = time.time()
+    main._store_cached_claims(b"k", {"exp": now + 5})
+    assert main._get_cached_claims(b"k") == {"exp": now + 5}
+    monkeypatch.setattr(main.time, "time", lambda: now + 6)
+    assert main._get_cached_claims(b"k") is None
+    assert b"k" not in main._claims_cache
+
+
+def test_claims_cache_lru_eviction(monkeypatch):
+    monkeypatch.setattr(main, "CLAIMS_CACHE_MAXSIZE", 2)
+    exp = time.time() + 300
+    main._store_cached_claims(b"a", {"exp": exp})
+    main._store_cached_claims(b"b", {"exp": exp})
+    main._get_cached_claims(b"a")  # "a" is now most recently used
+    main._store_cached_claims(b"c", {"exp": exp})
+    assert list(main._claims_cache) == [b"a", b"c"]
+
+
+# ---------- AdminRoleMiddleware ----------
+
+def _get(path, token=None):
+    headers = {"Authorization": b"Bearer " + token} if token else {}
+    return TestClient(main.app).get(path, headers=headers)
+
+
+def test_middleware_missing_token():
+    r = _get("/rbac-secure")
+    assert r.status_code == 403
+    assert r.text == "Forbidden: missing bearer token"
+
+
+def test_middleware_invalid_token():
+    r = _get("/rbac-secure", make_token(roles=["admin"], aud="other-client"))
+    assert r.status_code == 403
+    assert r.text == "Forbidden: invalid token"
+
+
+def test_middleware_requires_admin_role():
+    r = _get("/rbac-secure", make_token(roles=["user"]))
+    assert r.status_code == 403
+    assert r.text == "Forbidden: admin role required"
+
+
+def test_middleware_admin_allowed_and_cached(fake_jwks):
+    token = make_token(roles=["admin"])
+    assert _get("/rbac-secure", token).status_code == 200
+    assert _get("/rbac-secure", token).status_code == 200
+    # Second request is served from the claims cache: no key lookup/verification
+    assert fake_jwks.calls == 1
+
+
+def test_middleware_ignores_unprotected_paths():
+    assert _get("/ping").text == "pong"
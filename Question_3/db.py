@@ -1,18 +1,40 @@
-from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from typing import Dict, Hashable, Mapping, Optional
+
+import asyncpg
+from fastapi import Request
 from .settings import settings
 
-engine: AsyncEngine = create_async_engine(
-    settings.DATABASE_URL,
-    pool_size=10,
-    max_overflow=20,
-    pool_pre_ping=True,
-)
+# asyncpg pool for all queries; min_size pre-creates connections at startup.
+# Created in the app lifespan and stored on app.state.pg_pool.
+def asyncpg_dsn(url) -> str:
+    """Strips a SQLAlchemy-style driver suffix: postgresql+asyncpg:// -> postgresql://"""
+    return str(url).replace("postgresql+asyncpg://", "postgresql://", 1)
+
+class PreparedConnection(asyncpg.Connection):
+    """asyncpg connection carrying server-side prepared statements by key."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_prepared: Dict[Hashable, asyncpg.prepared_stmt.PreparedStatement] = {}
+
+async def create_pg_pool(statements: Optional[Mapping[Hashable, str]] = None) -> asyncpg.Pool:
+    """
+    Creates the asyncpg pool. Every `statements` entry is prepared once per
+    physical connection (parsed/planned server-side) and exposed through
+    `conn.user_prepared[key]`.
+    """
+    async def _prepare(conn: PreparedConnection) -> None:
+        for key, sql in (statements or {}).items():
+            conn.user_prepared[key] = await conn.prepare(sql)
 
-AsyncSessionLocal = sessionmaker(
-    bind=engine, class_=AsyncSession, expire_on_commit=False
-)
+    return await asyncpg.create_pool(
+        asyncpg_dsn(settings.DATABASE_URL),
+        min_size=settings.pool_min_size,
+        max_size=settings.pool_max_size,
+        max_inactive_connection_lifetime=settings.POOL_MAX_INACTIVE_LIFETIME,
+        connection_class=PreparedConnection,
+        init=_prepare,
+    )
 
-async def get_session() -> AsyncSession:
-    async with AsyncSessionLocal() as session:
-        yield session
+def get_pg_pool(request: Request) -> asyncpg.Pool:
+    return request.app.state.pg_pool
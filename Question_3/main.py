@@ -1,15 +1,64 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from datetime import date, datetime
-from typing import List, Optional
+from itertools import product
+from typing import Annotated, Dict, List, Optional, Tuple
 
+import anyio
+import asyncpg
+import orjson
 from fastapi import FastAPI, Depends, Query, HTTPException
-from pydantic import BaseModel, Field, validator
-from sqlalchemy import text
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import Response, StreamingResponse
+from pydantic import AfterValidator, BaseModel, Field, ValidationInfo, field_validator
 
-from .db import get_session
+from .cache import TTLCache
+from .db import create_pg_pool, get_pg_pool
 from .settings import settings
 
-app = FastAPI(title=settings.APP_NAME)
+# Single source for the top_n default used by TopRegionsQuery and the endpoint
+DEFAULT_TOP_N: int = settings.TOP_N
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.pg_pool = await create_pg_pool(TOP_REGIONS_SQL)
+    try:
+        yield
+    finally:
+        await app.state.pg_pool.close()
+
+
+# No ORJSONResponse default (deprecated in current FastAPI): the analytics
+# endpoints return orjson-encoded bytes themselves, everything else goes
+# through FastAPI's pydantic-core serialization.
+app = FastAPI(title=settings.APP_NAME, lifespan=lifespan)
+
+# Serialized top-regions payloads keyed on the normalized query parameters
+top_regions_cache = TTLCache(
+    maxsize=settings.RESPONSE_CACHE_MAXSIZE, ttl=settings.RESPONSE_CACHE_TTL
+)
+
+
+def _cached_json_response(content: bytes, ttl: float) -> Response:
+    # max-age is the server-side entry's remaining lifetime, so client caches
+    # never extend staleness past one RESPONSE_CACHE_TTL after a refresh
+    return Response(
+        content, media_type="application/json", headers={"Cache-Control": f"max-age={int(ttl)}"}
+    )
+
+
+# Upper bound on distinct category filters per request (DoS guard)
+MAX_CATEGORIES = 100
+
+
+def normalize_categories(categories: Optional[List[str]]) -> Optional[List[str]]:
+    """Drops duplicate categories (keeping order) and enforces MAX_CATEGORIES."""
+    if not categories:
+        return None
+    unique = list(dict.fromkeys(categories))
+    if len(unique) > MAX_CATEGORIES:
+        raise ValueError(f"at most {MAX_CATEGORIES} distinct categories are allowed")
+    return unique
 
 
 # ---------- Request / Response Schemas ----------
@@ -17,12 +66,15 @@ app = FastAPI(title=settings.APP_NAME)
 class TopRegionsQuery(BaseModel):
     start_date: Optional[date] = Field(None, description="Inclusive (YYYY-MM-DD)")
     end_date: Optional[date] = Field(None, description="Inclusive (YYYY-MM-DD)")
-    categories: Optional[List[str]] = Field(None, description="Product categories to include")
-    top_n: int = Field(settings.TOP_N, ge=1, le=100, description="How many regions to return (default 5)")
+    categories: Annotated[Optional[List[str]], AfterValidator(normalize_categories)] = Field(
+        None, description="Product categories to include"
+    )
+    top_n: int = Field(DEFAULT_TOP_N, ge=1, le=100, description="How many regions to return (default 5)")
 
-    @validator("end_date")
-    def validate_range(cls, v, values):
-        sd = values.get("start_date")
+    @field_validator("end_date", mode="after")
+    @classmethod
+    def validate_range(cls, v, info: ValidationInfo):
+        sd = info.data.get("start_date")
         if sd and v and v < sd:
             raise ValueError("end_date must be >= start_date")
         return v
@@ -40,73 +92,249 @@ class TopRegionsResponse(BaseModel):
     results: List[RegionAggregate]
 
 
-# ---------- Endpoint ----------
+# ---------- SQL ----------
+
+def _build_where_sql(has_start: bool, has_end: bool, has_cat: bool) -> Tuple[str, int]:
+    """
+    Builds the WHERE clause over sales_daily_region for one combination of
+    filters, with positional ($n) params. Returns (where_sql, param_count).
+    """
+    where_clauses = []
+    n = 0
+    if has_start:
+        n += 1
+        where_clauses.append(f"sale_day >= ${n}")
+    if has_end:
+        # sale_day is a DATE, so the end bound is inclusive directly
+        n += 1
+        where_clauses.append(f"sale_day <= ${n}")
+    if has_cat:
+        n += 1
+        where_clauses.append(f"category = ANY(${n})")
+
+    where_sql = "WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+    return where_sql, n
+
+
+def _build_top_regions_sql(has_start: bool, has_end: bool, has_cat: bool) -> str:
+    where_sql, n = _build_where_sql(has_start, has_end, has_cat)
+    # Aggregate over the daily rollup (sql/001_sales_daily_region.sql)
+    # rather than scanning sales_data
+    return f"""
+        SELECT region,
+               SUM(sum_amt)::float8 AS total_sales,
+               SUM(orders)::bigint AS orders_count
+        FROM sales_daily_region
+        {where_sql}
+        GROUP BY region
+        ORDER BY total_sales DESC
+        LIMIT ${n + 1}
+    """
+
+
+# All 2^3 filter combinations, built once at import and keyed by
+# (has_start, has_end, has_cat). Each is prepared on every pool connection
+# at connect time (see db.create_pg_pool).
+TOP_REGIONS_SQL: Dict[Tuple[bool, bool, bool], str] = {
+    flags: _build_top_regions_sql(*flags) for flags in product((False, True), repeat=3)
+}
+
+# Daily rollup rows for /analytics/sales-stream, same filter variants
+SALES_STREAM_SQL: Dict[Tuple[bool, bool, bool], str] = {
+    flags: f"""
+        SELECT sale_day,
+               region,
+               category,
+               sum_amt::float8 AS total_sales,
+               orders AS orders_count
+        FROM sales_daily_region
+        {_build_where_sql(*flags)[0]}
+        ORDER BY sale_day, region, category
+    """
+    for flags in product((False, True), repeat=3)
+}
+
+# Rows fetched per cursor round-trip when streaming
+STREAM_PREFETCH = 500
+
+# Streams in flight per worker; extra requests get a 503 instead of queueing
+_stream_slots = asyncio.Semaphore(
+    max(1, min(settings.SALES_STREAM_MAX_CONCURRENCY, settings.pool_max_size // 2))
+)
+
+
+class _CleanupStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that awaits `cleanup` once sending ends, however it
+    ends (completed, client disconnect, cancellation), even if the body
+    iterator was never started.
+    """
+
+    def __init__(self, content, cleanup, **kwargs):
+        super().__init__(content, **kwargs)
+        self._cleanup = cleanup
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self._cleanup()
+
 
-@app.get("/analytics/top-regions", response_model=TopRegionsResponse, summary="Top N regions by total sales")
+# ---------- Endpoints ----------
+
+# Schemas above document the contract in OpenAPI; the handler returns plain
+# dicts so no per-row validation runs on the hot path.
+@app.get(
+    "/analytics/top-regions",
+    response_model=None,
+    responses={200: {"model": TopRegionsResponse}},
+    summary="Top N regions by total sales",
+)
 async def top_regions(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
     category: Optional[List[str]] = Query(None, alias="category"),
-    top_n: int = Query(settings.TOP_N, ge=1, le=100),
-    session: AsyncSession = Depends(get_session),
+    top_n: int = Query(DEFAULT_TOP_N, ge=1, le=100),
+    pool: asyncpg.Pool = Depends(get_pg_pool),
 ):
     """
     Returns the top N regions by SUM(total_amount) with optional filters:
     - start_date, end_date (inclusive)
     - category=cat1&category=cat2 (multi)
     """
-    # Build dynamic WHERE safely with bind params
-    where_clauses = []
-    params = {}
-
-    if start_date:
-        where_clauses.append("sale_date >= :start_date")
-        params["start_date"] = start_date
-    if end_date:
-        # Add 1 day to make end inclusive if your column is TIMESTAMP.
-        # If it is DATE, you can keep it inclusive directly.
-        where_clauses.append("sale_date < :end_exclusive")
-        params["end_exclusive"] = datetime.combine(end_date, datetime.max.time())
+    if start_date and end_date and end_date < start_date:
+        raise HTTPException(status_code=422, detail="end_date must be >= start_date")
+    try:
+        category = normalize_categories(category)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+
+    # Canonical order for both the cache key and the echoed query; ANY() ignores it
     if category:
-        where_clauses.append("category = ANY(:categories)")
-        params["categories"] = category
+        category.sort()
+    cache_key = (start_date, end_date, tuple(category) if category else None, top_n)
+    cached = top_regions_cache.get_with_ttl(cache_key)
+    if cached is not None:
+        return _cached_json_response(*cached)
 
-    where_sql = "WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+    # Bind params in the same order the precompiled variant expects
+    params = [v for v in (start_date, end_date, category) if v] + [top_n]
+    variant = (bool(start_date), bool(end_date), bool(category))
 
-    # Large-scale friendly aggregation
-    sql = text(f"""
-        SELECT region,
-               SUM(total_amount)::float8 AS total_sales,
-               COUNT(*) AS orders_count
-        FROM sales_data
-        {where_sql}
-        GROUP BY region
-        ORDER BY total_sales DESC
-        LIMIT :top_n
-    """)
-    params["top_n"] = top_n
+    try:
+        async with pool.acquire(timeout=settings.POOL_TIMEOUT) as conn:
+            rows = await conn.user_prepared[variant].fetch(*params)
+    except Exception as e:
+        # Surface a clean message (the actual error remains in logs)
+        raise HTTPException(status_code=500, detail="Query failed") from e
+
+    content = orjson.dumps({
+        "generated_at": datetime.utcnow(),
+        "query": {
+            "start_date": start_date,
+            "end_date": end_date,
+            "categories": category,
+            "top_n": top_n,
+        },
+        "results": [dict(row) for row in rows],
+    })
+    top_regions_cache.set(cache_key, content)
+    return _cached_json_response(content, top_regions_cache.ttl)
 
+
+@app.get("/analytics/sales-stream", summary="Daily sales rollup as NDJSON")
+async def sales_stream(
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    category: Optional[List[str]] = Query(None, alias="category"),
+    pool: asyncpg.Pool = Depends(get_pg_pool),
+):
+    """
+    Streams sales_daily_region rows (one JSON object per line) using a
+    server-side cursor, so memory stays constant regardless of result size.
+    Same filters as /analytics/top-regions.
+    """
+    if start_date and end_date and end_date < start_date:
+        raise HTTPException(status_code=422, detail="end_date must be >= start_date")
+    try:
+        category = normalize_categories(category)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+
+    params = [v for v in (start_date, end_date, category) if v]
+    sql = SALES_STREAM_SQL[(bool(start_date), bool(end_date), bool(category))]
+
+    if _stream_slots.locked():
+        raise HTTPException(status_code=503, detail="Too many concurrent streams")
+    await _stream_slots.acquire()
+
+    conn = tr = body = None
+    cleaned_up = False
+
+    async def cleanup():
+        # Idempotent; shielded so cancellation cannot skip the release
+        nonlocal cleaned_up
+        if cleaned_up:
+            return
+        cleaned_up = True
+        with anyio.CancelScope(shield=True):
+            try:
+                if body is not None:
+                    await body.aclose()
+                if tr is not None:
+                    # Read-only, so just end the cursor's transaction; release()
+                    # terminates it anyway if the connection is broken
+                    with suppress(Exception):
+                        await tr.rollback()
+            finally:
+                if conn is not None:
+                    await pool.release(conn)
+                _stream_slots.release()
+
+    # Open the cursor and fetch the first batch before committing to a 200,
+    # so DB failures surface as a 500 instead of an empty stream
     try:
-        res = await session.execute(sql, params)
+        conn = await pool.acquire(timeout=settings.POOL_TIMEOUT)
+        tr = conn.transaction()
+        await tr.start()
+        cursor = await conn.cursor(sql, *params)
+        batch = await cursor.fetch(STREAM_PREFETCH)
     except Exception as e:
+        await cleanup()
         # Surface a clean message (the actual error remains in logs)
         raise HTTPException(status_code=500, detail="Query failed") from e
+    except BaseException:
+        await cleanup()
+        raise
 
-    rows = res.mappings().all()
-
-    payload = TopRegionsResponse(
-        generated_at=datetime.utcnow(),
-        query=TopRegionsQuery(
-            start_date=start_date,
-            end_date=end_date,
-            categories=category,
-            top_n=top_n
-        ),
-        results=[RegionAggregate(**row) for row in rows],
-    )
-    return payload
+    async def rows(batch):
+        # The connection is held until the last row is sent
+        while batch:
+            yield b"".join(orjson.dumps(dict(row)) + b"\n" for row in batch)
+            batch = await cursor.fetch(STREAM_PREFETCH)
+
+    body = rows(batch)
+    return _CleanupStreamingResponse(body, cleanup, media_type="application/x-ndjson")
 
 
 @app.get("/health")
 async def health():
     return {"ok": True}
+
+
+# Run (prod): python -m Question_3.main  (pip install uvloop httptools)
+if __name__ == "__main__":
+    import os
+
+    import uvicorn
+
+    uvicorn.run(
+        f"{__package__}.main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+        # Same worker count the per-worker pool budget is computed from
+        workers=settings.WEB_CONCURRENCY,
+    )
@@ -0,0 +1,23 @@
+-- Optional covering index for date/category-filtered aggregations that still
+-- run directly against sales_data (ad-hoc/reporting queries). The API
+-- endpoints read sales_daily_region and do not use it, and the unfiltered
+-- GROUP BY in REFRESH MATERIALIZED VIEW scans the whole table either way.
+-- INCLUDE (region, total_amount) lets such filtered queries use an index-only
+-- scan. idx_sales_data_date_cat is left in place; drop it only after
+-- confirming nothing else relies on it.
+-- CONCURRENTLY cannot run inside a transaction block: run with psql -f as-is.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sales_date_cat_cov
+    ON sales_data (sale_date, category) INCLUDE (region, total_amount);
+
+-- Keep the visibility map current so index-only scans skip heap fetches:
+-- VACUUM (ANALYZE) sales_data;
+
+-- Verify the plan uses idx_sales_date_cat_cov (Index Only Scan, low Heap Fetches):
+-- EXPLAIN (ANALYZE, BUFFERS)
+-- SELECT region, SUM(total_amount), COUNT(*)
+-- FROM sales_data
+-- WHERE sale_date >= '2025-01-01' AND sale_date < '2025-04-01'
+--   AND category = ANY('{Electronics,Appliances}')
+-- GROUP BY region;
+-- If category is the more selective filter in your workload, swap the key
+-- order to (category, sale_date).
@@ -0,0 +1,33 @@
+import cache
+from cache import TTLCache
+
+
+def test_get_with_ttl_returns_value_and_remaining(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now)
+    c = TTLCache(maxsize=4, ttl=60)
+    c.set("k", b"v")
+    now = 1015.0
+    assert c.get_with_ttl("k") == (b"v", 45.0)
+    assert c.get_with_ttl("missing") is None
+
+
+def test_get_with_ttl_expires(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now)
+    c = TTLCache(maxsize=4, ttl=60)
+    c.set("k", b"v")
+    now = 1060.0
+    assert c.get_with_ttl("k") is None
+    assert "k" not in c._data
+
+
+def test_lru_eviction():
+    c = TTLCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get_with_ttl("a")  # "a" is now most recently used
+    c.set("c", 3)
+    assert c.get_with_ttl("b") is None
+    assert c.get_with_ttl("a")[0] == 1
+    assert c.get_with_ttl("c")[0] == 3